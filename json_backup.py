@@ -1,12 +1,34 @@
 import datetime
-import json
 import os
 
+from utils import json_dumps_bytes
+
 
 class JSONBackup:
-    @staticmethod
-    def backup_posts(posts, filename=None):
-        """將貼文資料清單備份存成 JSON 檔案。"""
+    def __init__(self, filename=None):
+        """
+        以串流方式將貼文寫入 JSON 備份檔，不需先把所有貼文累積在記憶體中。
+        filename 為 None 時，每次開始備份都使用當天日期的預設檔名。
+
+        使用方式：
+            with JSONBackup() as backup:
+                for page in pages:
+                    backup.write_page(page)
+        """
+        self.filename = filename
+        self.current_filename = None
+        self._file = None
+
+    def __enter__(self):
+        self.current_filename = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _open(self):
+        """第一次寫入時才建立檔案，沒有任何貼文時不會產生（或覆寫）備份檔。"""
+        filename = self.filename
         if filename is None:
             # 預設檔名：threads_post_backup_YYYYMMDD.json（依當天日期）
             date_str = datetime.datetime.now().strftime("%Y%m%d")
@@ -17,7 +39,35 @@ class JSONBackup:
         if directory and not os.path.exists(directory):
             os.makedirs(directory)
 
-        # 將資料寫入 JSON 檔案（確保中文不轉碼）
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(posts, f, ensure_ascii=False, indent=4)
-        return filename
+        # 以二進位模式寫入 UTF-8 JSON bytes，省去文字模式的再次編碼
+        self._file = open(filename, 'wb')
+        self._file.write(b"[")
+        self.current_filename = filename
+        self._first = True
+
+    def write_page(self, posts):
+        """將一頁貼文逐筆寫入備份檔（確保中文不轉碼）。"""
+        if not posts:
+            return
+        if self._file is None:
+            self._open()
+        for post in posts:
+            if not self._first:
+                self._file.write(b",\n")
+            self._file.write(json_dumps_bytes(post))
+            self._first = False
+
+    def close(self):
+        """寫入結尾的 ] 並關閉備份檔，回傳備份檔名（沒有寫入任何貼文則為 None）。"""
+        if self._file is not None:
+            self._file.write(b"]\n")
+            self._file.close()
+            self._file = None
+        return self.current_filename
+
+    @staticmethod
+    def backup_posts(posts, filename=None):
+        """將貼文資料清單備份存成 JSON 檔案。"""
+        with JSONBackup(filename) as backup:
+            backup.write_page(posts)
+        return backup.current_filename
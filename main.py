@@ -86,3 +86,6 @@ if __name__ == "__main__":
         csv_file = db.export_to_csv()
         if csv_file:
             print(f"CSV 檔案產生：{csv_file}")
+
+        # 同步結束後執行 WAL checkpoint，避免 WAL 檔隨著多次執行持續變大
+        db.reset_wal()
@@ -1,10 +1,39 @@
 import csv
-import datetime
-import json  # 確保有引入 json 模組
+import logging
 import os
 import sqlite3
 
-from utils import iso_to_unix
+from utils import iso_to_datetime, iso_to_unix, json_dumps
+
+logger = logging.getLogger(__name__)
+
+# 匯出 CSV 的欄位（不含 exported、replies_fetched 等同步狀態欄位）
+_EXPORT_COLUMNS = (
+    "id", "text", "media_type", "media_url", "thumbnail_url",
+    "permalink", "children", "timestamp", "is_quote_post",
+)
+
+# 批次寫入用的 SQL 於模組載入時建立一次，避免每次呼叫重新組字串
+_INSERT_POST_SQL = """
+    INSERT OR IGNORE INTO threads_posts(
+        id, text, media_type, media_url, thumbnail_url,
+        permalink, children, timestamp, is_quote_post
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_INSERT_REPLY_SQL = """
+    INSERT OR IGNORE INTO threads_replies(
+        id, post_id, text, username, permalink, timestamp,
+        media_type, media_url, shortcode, thumbnail_url, children,
+        has_replies, root_post, replied_to, is_reply, is_reply_owned_by_me, hide_status
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# 重複呼叫的查詢同樣固定為常數，每次傳入同一個字串物件以命中 statement 快取
+_UPDATE_REPLIES_FETCHED_SQL = "UPDATE threads_posts SET replies_fetched=1 WHERE id=?"
+_INSERT_SYNC_LOG_SQL = "INSERT INTO sync_log (start_time, end_time, count, initial, success) VALUES (?, ?, ?, ?, ?)"
+_MAX_TIMESTAMP_SQL = "SELECT MAX(timestamp) FROM threads_posts"
+_POSTS_WITHOUT_REPLIES_SQL = "SELECT id FROM threads_posts WHERE replies_fetched=0 AND media_type != 'REPOST_FACADE'"
 
 
 class SQLiteDB:
@@ -12,16 +41,48 @@ class SQLiteDB:
         """初始化資料庫連線並建立資料表。"""
         self.db_path = db_path
         self.conn = None
+        self._depth = 0  # 巢狀 with 的層數，最外層離開時才關閉連線
+        self._wal_enabled = False
+        self._tables_initialized = False
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_path)
-        self.cur = self.conn.cursor()
+        # 連線仍開啟時（巢狀使用）直接沿用，不重複建立連線與設定 PRAGMA
+        if self.conn is None:
+            # isolation_level=None：由程式自行以 BEGIN/COMMIT 控制批次交易，不讓 sqlite3 模組隱式開啟交易
+            # check_same_thread=False：同步貼文時由背景寫入執行緒（PostWriter）使用此連線，同一時間只有一個執行緒操作
+            # cached_statements=256：加大 prepared statement 快取，避免臨時查詢把常用語句擠出快取
+            self.conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                                        cached_statements=256)
+            self._configure_connection()
+            # sqlite3.Row 可用欄位名稱或索引取值，不依賴 SELECT 欄位的位置
+            self.conn.row_factory = sqlite3.Row
+            self.cur = self.conn.cursor()
+        self._depth += 1
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self.conn:
-            self.conn.close()
-            print("資料庫連線已關閉")
+        self._depth -= 1
+        if self._depth <= 0:
+            self.close()
+
+    def _configure_connection(self):
+        """設定連線的 PRAGMA：WAL + synchronous=NORMAL 避免每次 commit 都 fsync，其餘為快取與暫存設定。"""
+        # journal_mode=WAL 會記錄在資料庫檔案中並持續生效，同一條連線只需設定一次
+        if not self._wal_enabled:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self._wal_enabled = True
+        # 以下 PRAGMA 只對目前連線有效，每次建立連線都需要設定
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+        self.conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB
+
+    def reset_wal(self):
+        """
+        手動執行 WAL checkpoint 並將 -wal 檔截斷為 0，
+        避免長時間、多次同步後 WAL 檔持續變大，也讓 checkpoint 的停頓發生在可預期的時間點。
+        """
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
     def initialize_tables(self):
         """
@@ -43,8 +104,12 @@ class SQLiteDB:
           - exported       是否已匯出.csv (0/1)
           - replies_fetched 是否已取得留言 (0/1)
         """
-        # 建立 threads_posts 表
-        self.cur.execute("""
+        # 同一條連線只需建立一次，之後各同步流程再次呼叫時直接略過
+        if self._tables_initialized:
+            return
+        # 所有 DDL 合併為一段 script，以 executescript 一次送出
+        self.cur.executescript("""
+            -- 建立 threads_posts 表
             CREATE TABLE IF NOT EXISTS threads_posts (
                 id             TEXT PRIMARY KEY,
                 text           TEXT,
@@ -58,33 +123,30 @@ class SQLiteDB:
                 exported       INTEGER DEFAULT 0,
                 replies_fetched INTEGER DEFAULT 0
             );
-        """)
-        # 建立 threads_replies 表
-        self.cur.execute("""
-               CREATE TABLE IF NOT EXISTS threads_replies (
-                   id                TEXT PRIMARY KEY,
-                   post_id           TEXT,  -- 對應 threads_posts 的 id
-                   text              TEXT,
-                   username          TEXT,
-                   permalink         TEXT,
-                   timestamp         TEXT,
-                   media_type        TEXT,
-                   media_url         TEXT,
-                   shortcode         TEXT,
-                   thumbnail_url     TEXT,
-                   children          TEXT,
-                   has_replies       INTEGER,
-                   root_post         TEXT,
-                   replied_to        TEXT,
-                   is_reply          INTEGER,
-                   is_reply_owned_by_me INTEGER,
-                   hide_status       TEXT,
-                   FOREIGN KEY(post_id) REFERENCES threads_posts(id)
-               );
-           """)
-
-        # 建立 sync_log 表
-        self.cur.execute("""
+
+            -- 建立 threads_replies 表
+            CREATE TABLE IF NOT EXISTS threads_replies (
+                id                TEXT PRIMARY KEY,
+                post_id           TEXT,  -- 對應 threads_posts 的 id
+                text              TEXT,
+                username          TEXT,
+                permalink         TEXT,
+                timestamp         TEXT,
+                media_type        TEXT,
+                media_url         TEXT,
+                shortcode         TEXT,
+                thumbnail_url     TEXT,
+                children          TEXT,
+                has_replies       INTEGER,
+                root_post         TEXT,
+                replied_to        TEXT,
+                is_reply          INTEGER,
+                is_reply_owned_by_me INTEGER,
+                hide_status       TEXT,
+                FOREIGN KEY(post_id) REFERENCES threads_posts(id)
+            );
+
+            -- 建立 sync_log 表
             CREATE TABLE IF NOT EXISTS sync_log (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 start_time TEXT,
@@ -92,81 +154,84 @@ class SQLiteDB:
                 count INTEGER,
                 initial INTEGER,
                 success INTEGER
-            )
+            );
+
+            -- 建立索引：留言同步待處理清單、最新 timestamp 查詢、尚未匯出的資料
+            CREATE INDEX IF NOT EXISTS idx_posts_pending_replies
+                ON threads_posts(replies_fetched, media_type) WHERE replies_fetched=0;
+            CREATE INDEX IF NOT EXISTS idx_posts_timestamp ON threads_posts(timestamp DESC);
+            CREATE INDEX IF NOT EXISTS idx_posts_exported ON threads_posts(exported) WHERE exported=0;
         """)
-        self.conn.commit()
+        self._tables_initialized = True
 
     def insert_posts(self, posts):
         """
         將單一或多筆貼文資料插入資料庫，
-        如果 posts 為 list 則依序處理；如果為 dict 則視為單筆資料處理。
+        如果 posts 為 list 則批次處理；如果為 dict 則視為單筆資料處理。
+        所有資料先轉成參數 tuple，再以 executemany 在單一交易中寫入，
         使用 INSERT OR IGNORE 避免重複插入。
+        成功回傳 True；寫入失敗時 rollback 並回傳 False。
         """
-        if isinstance(posts, list):
-            for post in posts:
-                normalized_post = self._normalize_post(post)
-                self._insert_single_post(normalized_post)
-        elif isinstance(posts, dict):
-            normalized_post = self._normalize_post(posts)
-            self._insert_single_post(normalized_post)
-        self.conn.commit()
-
-    def _insert_single_post(self, normalized_post):
-        sql = """
-            INSERT OR IGNORE INTO threads_posts(
-                id, text, media_type, media_url, thumbnail_url,
-                permalink, children, timestamp, is_quote_post
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        # 將 children 轉換為 JSON 字串（如果有資料）
-        children_json = json.dumps(normalized_post.get('children')) if normalized_post.get(
-            'children') is not None else None
+        if isinstance(posts, dict):
+            posts = [posts]
+        elif not isinstance(posts, list):
+            return True
+        rows = [self._to_row(post) for post in posts]
+        if not rows:
+            return True
         try:
-            self.cur.execute(sql, (
-                normalized_post.get('id'),
-                normalized_post.get('text'),
-                normalized_post.get('media_type'),
-                normalized_post.get('media_url'),
-                normalized_post.get('thumbnail_url'),
-                normalized_post.get('permalink'),
-                children_json,
-                normalized_post.get('timestamp'),
-                normalized_post.get('is_quote_post')
-            ))
-            print(f"成功插入貼文，id: {normalized_post.get('id')}")
+            self.cur.execute("BEGIN")
+            self.cur.executemany(_INSERT_POST_SQL, rows)
+            inserted = self.cur.rowcount
+            self.conn.commit()
+            print(f"成功插入 {inserted} 筆貼文，{len(rows) - inserted} 筆重複略過")
+            return True
         except Exception as e:
+            self.conn.rollback()
             print("插入資料錯誤:", e)
+            return False
+
+    def get_existing_post_ids(self, post_ids):
+        """查詢 post_ids 中已存在於 threads_posts 的 id，回傳 set。"""
+        post_ids = list(post_ids)
+        if not post_ids:
+            return set()
+        placeholders = ",".join("?" * len(post_ids))
+        self.cur.execute(f"SELECT id FROM threads_posts WHERE id IN ({placeholders})", post_ids)
+        return {row[0] for row in self.cur.fetchall()}
 
-    def _normalize_post(self, post):
+    def _to_row(self, post):
         """
-        將 API 回傳的貼文資料做必要轉換：
-         - 若 is_quote_post 為布林值，轉換成 1 (True) 或 0 (False)
-         - 若 children 欄位存在且為 dict，取其中的 "data" 部分；否則直接保持原格式
+        將 API 回傳的貼文資料直接轉換成 INSERT 用的參數 tuple（不複製整個 dict）：
+         - 若 is_quote_post 為布林值或整數，轉換成 1 (True) 或 0 (False)，其他情況預設為 0
+         - 若 children 欄位存在且為 dict，取其中的 "data" 部分；否則直接保持原格式，再轉為 JSON 字串
         :param post: 原始貼文資料字典
-        :return: 經過轉換後的貼文資料字典
+        :return: 對應 _INSERT_POST_SQL 欄位順序的 tuple
         """
-        normalized = post.copy()
-        # 轉換 is_quote_post
-        is_quote = normalized.get('is_quote_post')
-        if isinstance(is_quote, bool):
-            normalized['is_quote_post'] = 1 if is_quote else 0
-        elif isinstance(is_quote, int):
-            normalized['is_quote_post'] = 1 if is_quote else 0
-        else:
-            normalized['is_quote_post'] = 0  # 預設為 0
+        is_quote = post.get('is_quote_post')
+        is_quote = 1 if isinstance(is_quote, int) and is_quote else 0
 
-        # 處理 children 欄位
-        children = normalized.get('children')
+        children = post.get('children')
         if children and isinstance(children, dict) and 'data' in children:
-            normalized['children'] = children['data']
-        return normalized
+            children = children['data']
+        # 將 children 轉換為 JSON 字串（如果有資料）
+        children_json = json_dumps(children) if children is not None else None
+        return (
+            post.get('id'),
+            post.get('text'),
+            post.get('media_type'),
+            post.get('media_url'),
+            post.get('thumbnail_url'),
+            post.get('permalink'),
+            children_json,
+            post.get('timestamp'),
+            is_quote
+        )
 
     def _parse_time(self, time_str):
         """解析時間字串為 Unix 時間（秒）。"""
         try:
-            dt = datetime.datetime.strptime(time_str, "%Y-%m-%dT%H:%M:%S%z")
-            return int(dt.timestamp())
+            return int(iso_to_datetime(time_str).timestamp())
         except Exception:
             try:
                 return int(time_str)
@@ -175,7 +240,7 @@ class SQLiteDB:
 
     def get_max_timestamp(self):
         """取得 threads_posts 表中最大的 timestamp 值。"""
-        self.cur.execute("SELECT MAX(timestamp) FROM threads_posts")
+        self.cur.execute(_MAX_TIMESTAMP_SQL)
         result = self.cur.fetchone()
         if result and result[0]:
             return iso_to_unix(result[0])
@@ -185,7 +250,7 @@ class SQLiteDB:
     def log_sync(self, start_time, end_time, count, initial, success):
         """記錄同步日誌到 sync_log 表。"""
         self.cur.execute(
-            "INSERT INTO sync_log (start_time, end_time, count, initial, success) VALUES (?, ?, ?, ?, ?)",
+            _INSERT_SYNC_LOG_SQL,
             (start_time, end_time, count, 1 if initial else 0, 1 if success else 0)
         )
         self.conn.commit()
@@ -202,32 +267,23 @@ class SQLiteDB:
             print(f"CSV 檔案產生：{csv_filename}")
         """
         try:
-            # 查詢尚未匯出的資料
-            self.cur.execute("SELECT * FROM threads_posts WHERE exported=0")
-            rows = self.cur.fetchall()
-            if not rows:
+            # 匯出與更新 exported 放在同一個交易中，確保匯出的資料與標記為已匯出的資料一致
+            self.cur.execute("BEGIN IMMEDIATE")
+            # 直接由 SQL 取得筆數與最早/最新時間（ISO8601 字串可直接比較大小），不需逐筆解析
+            self.cur.execute("SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM threads_posts WHERE exported=0")
+            row_count, earliest_ts, latest_ts = self.cur.fetchone()
+            if not row_count:
+                self.conn.rollback()
                 print("沒有未匯出的資料。")
                 return
 
-            # 取得欄位名稱（用於 CSV 檔案首行）
-            colnames = [desc[0] for desc in self.cur.description]
-
-            # 假設 timestamp 為第 8 欄 (索引 7)，時間格式為 ISO8601
-            timestamps = []
-            for row in rows:
-                ts_str = row[7]  # 取得 timestamp 字串
-                try:
-                    dt = datetime.datetime.strptime(ts_str, "%Y-%m-%dT%H:%M:%S%z")
-                    timestamps.append(dt)
-                except Exception as e:
-                    print(f"解析 timestamp 失敗: {ts_str}, 錯誤: {e}")
-
-            if not timestamps:
-                print("無法解析任何 timestamp。")
+            try:
+                earliest_dt = iso_to_datetime(earliest_ts)
+                latest_dt = iso_to_datetime(latest_ts)
+            except Exception as e:
+                self.conn.rollback()
+                print(f"解析 timestamp 失敗: {earliest_ts} ~ {latest_ts}, 錯誤: {e}")
                 return
-
-            earliest_dt = min(timestamps)
-            latest_dt = max(timestamps)
             earliest_str = earliest_dt.strftime("%Y%m%d")
             latest_str = latest_dt.strftime("%Y%m%d")
 
@@ -239,45 +295,51 @@ class SQLiteDB:
             if directory and not os.path.exists(directory):
                 os.makedirs(directory)
 
-            # 將資料寫入 CSV 檔案（覆寫模式）
+            # 查詢尚未匯出的資料（只取匯出需要的欄位），逐筆串流寫入 CSV 檔案（覆寫模式），不將所有資料載入記憶體
+            self.cur.execute(f"SELECT {', '.join(_EXPORT_COLUMNS)} FROM threads_posts WHERE exported=0")
             with open(csv_filename, "w", encoding="utf-8", newline="") as csvfile:
                 writer = csv.writer(csvfile)
-                writer.writerow(colnames)
-                writer.writerows(rows)
-            print(f"成功匯出 {len(rows)} 筆資料到 {csv_filename}")
+                writer.writerow(_EXPORT_COLUMNS)
+                for row in self.cur:
+                    writer.writerow(row)
 
             # 更新這批資料的 exported 欄位為 1，避免重複匯出
             self.cur.execute("UPDATE threads_posts SET exported=1 WHERE exported=0")
             self.conn.commit()
+            print(f"成功匯出 {row_count} 筆資料到 {csv_filename}")
             return csv_filename
 
         except Exception as e:
+            if self.conn.in_transaction:
+                self.conn.rollback()
             print("匯出 CSV 過程中發生錯誤:", e)
 
     def close(self):
         """關閉資料庫連線。"""
-        self.conn.close()
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+            self._depth = 0
+            # WAL 模式與資料表是否已建立只對這條連線所對應的資料庫有效（檔案可能被刪除、替換或為 :memory:），
+            # 重新開啟時需再次設定與確認
+            self._wal_enabled = False
+            self._tables_initialized = False
+            logger.debug("資料庫連線已關閉")
 
-    def insert_replies(self, post_id, replies):
-        """
-        將指定文章（post_id）的留言資料插入 threads_replies 表中。
+    def insert_replies(self, post_replies):
         """
-        sql = """
-            INSERT OR IGNORE INTO threads_replies(
-                id, post_id, text, username, permalink, timestamp,
-                media_type, media_url, shortcode, thumbnail_url, children,
-                has_replies, root_post, replied_to, is_reply, is_reply_owned_by_me, hide_status
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        將多篇文章的留言資料插入 threads_replies 表中。
+        post_replies 為 (post_id, replies) 的 list，所有留言先轉成參數 tuple 再以 executemany 一次寫入。
+        此方法不會自行 commit，交易由呼叫端（例如 save_replies_batch）控制。
         """
-        for reply in replies:
-            # 若 reply 裡面的 children 欄位也是 dict，可轉換為 JSON 字串
-            children_json = json.dumps(reply.get('children')) if reply.get('children') is not None else None
-            root_post = json.dumps(reply.get('root_post')) if reply.get('root_post') is not None else None
-            replied_to = json.dumps(reply.get('replied_to')) if reply.get('replied_to') is not None else None
-
-            try:
-                self.cur.execute(sql, (
+        rows = []
+        for post_id, replies in post_replies:
+            for reply in replies:
+                # 若 reply 裡面的 children 欄位也是 dict，可轉換為 JSON 字串
+                children_json = json_dumps(reply.get('children')) if reply.get('children') is not None else None
+                root_post = json_dumps(reply.get('root_post')) if reply.get('root_post') is not None else None
+                replied_to = json_dumps(reply.get('replied_to')) if reply.get('replied_to') is not None else None
+                rows.append((
                     reply.get('id'),
                     post_id,
                     reply.get('text'),
@@ -296,26 +358,46 @@ class SQLiteDB:
                     1 if reply.get('is_reply_owned_by_me') else 0,
                     reply.get('hide_status')
                 ))
-                print(f"成功插入留言，reply id: {reply.get('id')} (post_id: {post_id})")
-            except Exception as e:
-                print(f"插入留言錯誤 (reply id: {reply.get('id')}):", e)
-        self.conn.commit()
+        if not rows:
+            return 0
+        self.cur.executemany(_INSERT_REPLY_SQL, rows)
+        inserted = self.cur.rowcount
+        print(f"成功插入 {inserted} 筆留言，{len(rows) - inserted} 筆重複略過")
+        return inserted
+
+    def update_replies_fetched(self, post_ids):
+        """
+        將多篇文章(post_ids)的 replies_fetched 欄位更新為1。
+        使用固定的 SQL 搭配 executemany，不論筆數多寡都共用同一個 prepared statement，
+        也不受 SQLite 參數數量上限影響。
+        此方法不會自行 commit，交易由呼叫端（例如 save_replies_batch）控制。
+        """
+        self.cur.executemany(_UPDATE_REPLIES_FETCHED_SQL, ((post_id,) for post_id in post_ids))
 
-    def update_replies_fetched(self, post_id):
+    def save_replies_batch(self, post_replies):
         """
-        更新指定文章(post_id)的 replies_fetched 欄位為1。
+        在單一交易內寫入一批文章的留言，並將這批文章標記為已同步留言。
+        post_replies 為 (post_id, replies) 的 list，沒有留言的文章 replies 可為空 list。
+        成功回傳 True；失敗時整批 rollback 並回傳 False，下次同步會再重新處理這批文章。
         """
+        if not post_replies:
+            return True
         try:
-            self.cur.execute("UPDATE threads_posts SET replies_fetched=1 WHERE id=?", (post_id,))
+            self.cur.execute("BEGIN")
+            self.insert_replies(post_replies)
+            self.update_replies_fetched([post_id for post_id, _ in post_replies])
             self.conn.commit()
+            return True
         except Exception as e:
-            print(f"更新 replies_fetched 錯誤 (post_id: {post_id}):", e)
+            self.conn.rollback()
+            print(f"寫入留言批次錯誤 (共 {len(post_replies)} 篇文章):", e)
+            return False
 
     def get_posts_without_replies(self):
         """
         查詢所有 media_type != 'REPOST_FACADE' 且 replies_fetched = 0 的貼文，
         用於進行留言同步。
         """
-        self.cur.execute("SELECT id FROM threads_posts WHERE replies_fetched=0 AND media_type != 'REPOST_FACADE'")
+        self.cur.execute(_POSTS_WITHOUT_REPLIES_SQL)
         rows = self.cur.fetchall()
         return [row[0] for row in rows]
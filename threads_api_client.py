@@ -1,39 +1,101 @@
 import datetime
+import random
+import threading
 import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from utils import load_config, update_config_token, is_token_near_expiry
+from utils import get_config_manager
+
+# API 要求的欄位清單
+_POST_FIELDS = "id,media_type,text,media_url,thumbnail_url,permalink,children,timestamp,is_quote_post"
+_REPLY_FIELDS = ("id,text,username,permalink,timestamp,media_type,media_url,shortcode,thumbnail_url,children,"
+                 "has_replies,root_post,replied_to,is_reply,is_reply_owned_by_me,hide_status")
+
+
+class RateLimiter:
+    def __init__(self, max_per_second):
+        """執行緒安全的簡易限速器，確保任兩次請求之間至少間隔 1/max_per_second 秒。"""
+        self.interval = 1.0 / max_per_second if max_per_second else 0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        """預約下一個可發送請求的時間點，必要時 sleep 到該時間點。"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
 
 
 class ThreadsAPIClient:
-    def __init__(self, access_token, base_url="https://graph.threads.net/v1.0"):
-        """初始化 Threads API 用戶端，需提供存取權杖和基本 URL。"""
+    def __init__(self, access_token, base_url="https://graph.threads.net/v1.0", max_requests_per_second=5,
+                 max_connections=20):
+        """
+        初始化 Threads API 用戶端，需提供存取權杖和基本 URL。
+        max_requests_per_second 限制所有執行緒合計每秒最多發出的請求數，避免並行抓取時觸發 API 限流。
+        max_connections 為每個主機保留的 keep-alive 連線數，應不小於並行抓取的執行緒數。
+        """
         self.access_token = access_token
         self.base_url = base_url
+        # 共用 Session 以重複使用 TCP/TLS 連線（keep-alive）
+        # adapter 只重試連線/讀取層級的錯誤；429/5xx 等狀態碼由 _request_with_retry 分類處理
+        # status=0 且不依 Retry-After 重試，否則 urllib3 會自行重送 429/503 回應，繞過限速器並使重試次數倍增
+        retry = Retry(total=3, connect=3, read=3, status=0, backoff_factor=1, respect_retry_after_header=False)
+        self.session = requests.Session()
+        # 所有請求都送往同一個主機，只需少量連線池；pool_block=True 讓超出 max_connections 的執行緒
+        # 等待閒置連線，而不是另開一條用完即丟的新連線（每次都要重新 TCP/TLS 握手）
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max_connections, pool_block=True, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.timeout = (5, 30)  # (連線逾時, 讀取逾時) 秒
+        self.rate_limiter = RateLimiter(max_requests_per_second)
+
+    def _get(self, url):
+        """經過限速器後以共用 Session 發送 GET 請求。"""
+        self.rate_limiter.wait()
+        return self.session.get(url, timeout=self.timeout)
+
+    def _request_with_retry(self, url, max_retries=3, base_delay=5):
+        """
+        發送 GET 請求並依 HTTP 狀態碼分類重試，成功時回傳解析後的 JSON：
+          - 429（遭到限流）：依 Retry-After 標頭等待，沒有標頭時使用指數退避
+          - 5xx（伺服器暫時性錯誤）：指數退避 base_delay * 2^n（上限 60 秒）並加上隨機抖動，避免並行請求同時重試
+          - 其他 4xx（權杖失效、參數錯誤等）：重試沒有意義，直接拋出 HTTPError
+        最多嘗試 max_retries 次，仍失敗則拋出 Exception。
+        """
+        retries = 0
+        while True:
+            print(f"呼叫 API：{url}")
+            response = self._get(url)
+            try:
+                response.raise_for_status()
+                return response.json()
+            except requests.exceptions.HTTPError as he:
+                status = response.status_code
+                if status != 429 and status < 500:
+                    raise
+                retries += 1
+                if retries >= max_retries:
+                    raise Exception(f"API持續發生錯誤，已嘗試 {max_retries} 次，無法取得 URL: {url}") from he
+                delay = min(60, base_delay * 2 ** (retries - 1)) + random.uniform(0, base_delay)
+                retry_after = response.headers.get("Retry-After")
+                if status == 429 and retry_after and retry_after.isdigit():
+                    delay = int(retry_after)
+                print(f"HTTP error: {he}, {delay:.1f} 秒後重試 {retries}/{max_retries} 次...")
+                time.sleep(delay)
 
     def fetch_posts_paginated(self, since=None, max_retries=3):
-        fields = "id,media_type,text,media_url,thumbnail_url,permalink,children,timestamp,is_quote_post"
-        url = f"{self.base_url}/me/threads?limit=50&fields={fields}&access_token={self.access_token}"
+        url = f"{self.base_url}/me/threads?limit=50&fields={_POST_FIELDS}&access_token={self.access_token}"
         if since:
             url += f"&since={since}"
         while url:
-            retries = 0
-            while retries < max_retries:
-                try:
-                    print(f"呼叫 API：{url}")
-                    response = requests.get(url)
-                    response.raise_for_status()
-                    data = response.json()
-                    break
-                except requests.exceptions.HTTPError as he:
-                    retries += 1
-                    print(f"HTTP error: {he}, 重試 {retries}/{max_retries} 次...")
-                    time.sleep(5)  # 等待 5 秒後重試
-            else:
-                # 經過 max_retries 次重試後仍失敗
-                raise Exception(f"API持續發生錯誤，無法取得 URL: {url}")
-
+            data = self._request_with_retry(url, max_retries=max_retries, base_delay=5)
             posts = data.get("data", [])
             yield posts
             if "paging" in data and "next" in data["paging"]:
@@ -41,24 +103,20 @@ class ThreadsAPIClient:
             else:
                 url = None
 
-    def fetch_posts_by_range(self, since=None, until=None):
+    def fetch_posts_by_range(self, since=None, until=None, max_retries=3):
         """
         以時間區間抓取貼文，支援 since 與 until 參數（ISO8601 時間字串）。
         當 both provided 時，僅抓取該時間段內的貼文。
         當只提供 until 時，則抓取直到此時間點以內的貼文。
         """
-        fields = "id,media_type,text,media_url,thumbnail_url,permalink,children,timestamp,is_quote_post"
-        url = f"{self.base_url}/me/threads?limit=50&fields={fields}&access_token={self.access_token}"
+        url = f"{self.base_url}/me/threads?limit=50&fields={_POST_FIELDS}&access_token={self.access_token}"
         if since:
             url += f"&since={since}"
         if until:
             url += f"&until={until}"
         posts = []
         while url:
-            print(f"呼叫 API：{url}")
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
+            data = self._request_with_retry(url, max_retries=max_retries, base_delay=5)
             if "data" in data:
                 posts.extend(data["data"])
             if "paging" in data and "next" in data["paging"]:
@@ -73,23 +131,11 @@ class ThreadsAPIClient:
         使用 API 端點：
         https://graph.threads.net/v1.0/<post_id>/conversation?fields=<想取得的資料參數>&reverse=false&access_token=<AccessToken>
         """
-        fields = "id,text,username,permalink,timestamp,media_type,media_url,shortcode,thumbnail_url,children,has_replies,root_post,replied_to,is_reply,is_reply_owned_by_me,hide_status"
-        url = f"{self.base_url}/{post_id}/conversation?reverse=false&fields={fields}&access_token={self.access_token}"
-        retries = 0
-        while retries < max_retries:
-            try:
-                print(f"呼叫留言 API：{url}")
-                response = requests.get(url)
-                response.raise_for_status()
-                data = response.json()
-                # 根據 API 回傳結構，留言通常位於 data 內
-                replies = data.get("data", [])
-                return replies
-            except requests.exceptions.HTTPError as he:
-                retries += 1
-                print(f"留言 API HTTP error: {he}, 重試 {retries}/{max_retries} 次...")
-                time.sleep(3)
-        raise Exception(f"取得文章 {post_id} 的留言失敗，已重試 {max_retries} 次")
+        url = f"{self.base_url}/{post_id}/conversation?reverse=false&fields={_REPLY_FIELDS}&access_token={self.access_token}"
+        data = self._request_with_retry(url, max_retries=max_retries, base_delay=3)
+        # 根據 API 回傳結構，留言通常位於 data 內
+        replies = data.get("data", [])
+        return replies
 
     def refresh_long_lived_token(self, current_token):
         """
@@ -101,7 +147,7 @@ class ThreadsAPIClient:
         回傳的 JSON 物件中會包含新的 access_token 與 expires_in。
         """
         url = f"https://graph.threads.net/refresh_access_token?grant_type=th_refresh_token&access_token={current_token}"
-        response = requests.get(url)
+        response = self.session.get(url, timeout=self.timeout)
         response.raise_for_status()
         return response.json()
 
@@ -111,15 +157,19 @@ class ThreadsAPIClient:
         若是，呼叫刷新 API 並更新 config.json 中的 access_token 與 expires_at。
         回傳最新的 token 與 expires_at。
         """
-        config = load_config(config_path)
+        # 與 utils 的配置函式共用同一個 ConfigManager，config.json 未變動時不會重新讀檔
+        config_manager = get_config_manager(config_path)
+        config = config_manager.config
         current_token = config.get("access_token")
-        if is_token_near_expiry(threshold_days=threshold_days, config_path=config_path):
+        # 沒有 expires_at 記錄時視為需要刷新
+        if config_manager.near_expiry(threshold_days):
             print("Token 即將過期，開始刷新...")
             refresh_data = self.refresh_long_lived_token(current_token)
             new_token = refresh_data.get("access_token")
             new_expires_in = int(refresh_data.get("expires_in", 0))
             if new_token and new_expires_in:
-                updated_config = update_config_token(new_token, new_expires_in, config_path=config_path)
+                updated_config = config_manager.update(new_token, new_expires_in)
+                self.access_token = updated_config["access_token"]
                 print(
                     f"刷新成功，新 token 有效期到 {datetime.datetime.fromtimestamp(updated_config['expires_at']).isoformat()}")
                 return updated_config["access_token"], updated_config["expires_at"]
@@ -1,8 +1,76 @@
+import contextlib
 import datetime
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from utils import iso_to_unix
 
 
+class PostWriter:
+    def __init__(self, db_handler, batch_size=500, max_pending_pages=4):
+        """
+        背景寫入執行緒：抓取端以 put() 送入貼文頁面，由單一執行緒負責寫入 DB，讓 API 抓取與 DB 寫入重疊進行。
+        頁面先累積到 batch_size 筆再一次寫入；佇列最多暫存 max_pending_pages 頁，寫入跟不上時抓取端會等待。
+        寫入期間 DB 連線只由背景執行緒使用，呼叫端在 with 區塊內不應再操作 DB。
+
+        使用方式：
+            with PostWriter(db) as writer:
+                for page in pages:
+                    if not writer.put(page):
+                        break
+            if writer.errors:
+                ...
+        """
+        self.db = db_handler
+        self.batch_size = batch_size
+        self.errors = []
+        self._queue = queue.Queue(maxsize=max_pending_pages)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._queue.put(None)  # 結束訊號：寫入剩餘資料後結束執行緒
+        self._thread.join()
+
+    def put(self, posts):
+        """送入一頁貼文並回傳 True；背景寫入已失敗時不再送入並回傳 False，抓取端應停止抓取。"""
+        if self.errors:
+            return False
+        self._queue.put(posts)
+        return True
+
+    def _run(self):
+        batch = []
+        while True:
+            posts = self._queue.get()
+            if posts is None:
+                break
+            if self.errors:
+                continue  # 已發生錯誤：仍持續清空佇列，避免抓取端卡在已滿的佇列
+            batch.extend(posts)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch and not self.errors:
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """略過已存在於 DB 的貼文後，將整批貼文一次寫入。"""
+        try:
+            existing_ids = self.db.get_existing_post_ids(post.get('id') for post in batch)
+            if existing_ids:
+                batch = [post for post in batch if post.get('id') not in existing_ids]
+            if batch and not self.db.insert_posts(batch):
+                self.errors.append(Exception("insert_posts 寫入失敗"))
+        except Exception as e:
+            self.errors.append(e)
+            print(f"背景寫入貼文失敗：{e}")
+
+
 class ThreadsSyncManager:
     def __init__(self, api_client, db_handler, backup_handler=None):
         """同步管理，整合 API、資料庫及備份模組。"""
@@ -10,53 +78,91 @@ class ThreadsSyncManager:
         self.db = db_handler
         self.backup = backup_handler
 
+    def _backup_writer(self, backup):
+        """需要備份時回傳備份模組（作為 context manager 串流寫入），否則回傳不做事的 context。"""
+        if backup and self.backup:
+            return self.backup
+        return contextlib.nullcontext()
+
+    def _filter_seen_posts(self, page, seen_ids):
+        """
+        過濾掉本次同步中已處理過（seen_ids）的貼文；已存在於 DB 的貼文則由 PostWriter 在寫入前略過。
+        避免重複貼文還要經過正規化、JSON 序列化與 INSERT OR IGNORE 的主鍵衝突檢查。
+        """
+        new_posts = []
+        for post in page:
+            post_id = post.get('id')
+            if post_id in seen_ids:
+                continue
+            seen_ids.add(post_id)
+            new_posts.append(post)
+        return new_posts
+
     def initial_sync(self, backup=False):
-        """初始同步所有歷史 Threads 貼文，採用分頁處理即時寫入 DB，遇錯不中斷前面成果。"""
+        """
+        初始同步所有歷史 Threads 貼文，採用分頁處理即時寫入 DB，遇錯不中斷前面成果。
+        DB 寫入交由背景的 PostWriter 進行，抓取下一頁與寫入上一頁同時進行。
+        """
         start_time = datetime.datetime.now().isoformat()
         success = True
         total_count = 0
-        all_posts_for_backup = []  # 備份用：累計所有抓取的貼文
+        seen_ids = set()
         self.db.initialize_tables()
+        post_writer = PostWriter(self.db)
         try:
-            # 使用逐頁抓取，假設 API 客戶端已改為 fetch_posts_paginated()
-            for page in self.api.fetch_posts_paginated():
-                if page:
-                    self.db.insert_posts(page)  # 每一頁資料都立刻寫入 DB
-                    total_count += len(page)
-                    all_posts_for_backup.extend(page)
-                    print(f"已同步 {total_count} 筆貼文...")
+            with self._backup_writer(backup) as backup_writer, post_writer:
+                # 使用逐頁抓取，假設 API 客戶端已改為 fetch_posts_paginated()
+                for page in self.api.fetch_posts_paginated():
+                    if page:
+                        new_posts = self._filter_seen_posts(page, seen_ids)
+                        if new_posts and not post_writer.put(new_posts):  # 交給背景執行緒寫入 DB
+                            break  # 背景寫入已失敗，停止抓取
+                        total_count += len(page)
+                        if backup_writer:
+                            backup_writer.write_page(page)  # 備份用：逐頁串流寫入，不累積在記憶體
+                        print(f"已同步 {total_count} 筆貼文...")
         except Exception as e:
             success = False
             print(f"Error during initial sync (斷點模式): {e}")
-        if backup and self.backup and all_posts_for_backup:
-            self.backup.backup_posts(all_posts_for_backup)
+        # 抓取端拋出例外時背景寫入可能也已失敗，兩者都要回報，避免遺失的批次只被記成網路錯誤
+        if post_writer.errors:
+            success = False
+            print(f"Error during initial sync (斷點模式): 背景寫入 DB 失敗：{post_writer.errors[0]}")
         end_time = datetime.datetime.now().isoformat()
         self.db.log_sync(start_time, end_time, total_count, initial=True, success=success)
         return {"success": success, "count": total_count}
 
     def incremental_sync(self, backup=False):
-        """增量同步，自 DB 查詢 max timestamp 後進行新資料抓取。"""
+        """增量同步，自 DB 查詢 max timestamp 後進行新資料抓取，DB 寫入交由背景的 PostWriter 進行。"""
         self.db.initialize_tables()
         start_time = datetime.datetime.now().isoformat()
         success = True
         total_count = 0
-        all_posts_for_backup = []
+        seen_ids = set()
+        post_writer = PostWriter(self.db)
         try:
+            # 在背景寫入開始前先查詢，PostWriter 執行期間 DB 只由背景執行緒使用
             last_ts = self.db.get_max_timestamp()
             since = last_ts + 1 if last_ts else None
-            for page in self.api.fetch_posts_paginated(since=since):
-                if page:
-                    self.db.insert_posts(page)
-                    total_count += len(page)
-                    all_posts_for_backup.extend(page)
-                    print(f"增量同步：已新增 {total_count} 筆貼文...")
-                else:
-                    break
+            with self._backup_writer(backup) as backup_writer, post_writer:
+                for page in self.api.fetch_posts_paginated(since=since):
+                    if page:
+                        new_posts = self._filter_seen_posts(page, seen_ids)
+                        if new_posts and not post_writer.put(new_posts):
+                            break  # 背景寫入已失敗，停止抓取
+                        total_count += len(page)
+                        if backup_writer:
+                            backup_writer.write_page(page)
+                        print(f"增量同步：已新增 {total_count} 筆貼文...")
+                    else:
+                        break
         except Exception as e:
             success = False
             print(f"Error during incremental sync: {e}")
-        if backup and self.backup and all_posts_for_backup:
-            self.backup.backup_posts(all_posts_for_backup)
+        # 抓取端拋出例外時背景寫入可能也已失敗，兩者都要回報
+        if post_writer.errors:
+            success = False
+            print(f"Error during incremental sync: 背景寫入 DB 失敗：{post_writer.errors[0]}")
         end_time = datetime.datetime.now().isoformat()
         self.db.log_sync(start_time, end_time, total_count, initial=False, success=success)
         return {"success": success, "count": total_count}
@@ -75,7 +181,8 @@ class ThreadsSyncManager:
             count = len(posts)
             if backup and self.backup:
                 self.backup.backup_posts(posts)
-            self.db.insert_posts(posts)
+            if not self.db.insert_posts(posts):
+                raise Exception("insert_posts 寫入失敗")
         except Exception as e:
             success = False
             count = 0
@@ -84,12 +191,14 @@ class ThreadsSyncManager:
         self.db.log_sync(start_time, end_time, count, initial=False, success=success)
         return {"success": success, "count": count}
 
-    def sync_replies(self, backup=False):
+    def sync_replies(self, backup=False, batch_size=50, max_workers=8):
         """
         同步 DB 中所有尚未取得留言的貼文留言。
         僅針對 media_type != 'REPOST_FACADE' 的貼文進行。
         使用 API 呼叫 /<post_id>/conversation 取得留言。
         將留言資料存入 DB 的 thread_replies 表，並更新該貼文的 replies_fetched 為 1。
+        以 max_workers 個執行緒並行呼叫留言 API（請求速率由 API 用戶端的限速器控制），
+        每累積 batch_size 篇文章才在單一交易中寫入一次 DB，減少 commit 次數。
 
         使用方式：
             result = sync_manager.sync_replies(backup=True)
@@ -100,19 +209,28 @@ class ThreadsSyncManager:
         total_count = 0
         try:
             post_ids = self.db.get_posts_without_replies()
-            for post_id in post_ids:
-                try:
-                    # 呼叫 API 取得留言
-                    replies = self.api.fetch_replies(post_id)
+            batch = []  # 累積 (post_id, replies)，每 batch_size 篇文章寫入一次 DB
+            # 留言以執行緒池並行抓取；DB 寫入只在目前執行緒進行，SQLite 連線不跨執行緒使用
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(self.api.fetch_replies, post_id): post_id for post_id in post_ids}
+                for future in as_completed(futures):
+                    post_id = futures[future]
+                    try:
+                        replies = future.result()
+                    except Exception as sub_e:
+                        print(f"同步文章 {post_id} 留言失敗：{sub_e}")
+                        continue
+                    # 無論是否有留言，都加入批次，寫入後該貼文會標記為已同步留言
+                    batch.append((post_id, replies or []))
                     if replies:
-                        # 將留言插入 DB
-                        self.db.insert_replies(post_id, replies)
                         total_count += len(replies)
                         print(f"文章 {post_id} 同步 {len(replies)} 筆留言")
-                    # 無論是否有留言，更新該貼文為已同步留言
-                    self.db.update_replies_fetched(post_id)
-                except Exception as sub_e:
-                    print(f"同步文章 {post_id} 留言失敗：{sub_e}")
+                    if len(batch) >= batch_size:
+                        if not self.db.save_replies_batch(batch):
+                            success = False
+                        batch = []
+            if not self.db.save_replies_batch(batch):
+                success = False
         except Exception as e:
             success = False
             print(f"Error during replies sync: {e}")
@@ -1,25 +1,244 @@
 import datetime
 import json
+import mmap
 import os
+import re
 import time
+import types
+
+try:
+    import orjson  # 選用套件：有安裝時以 orjson 進行較快的 JSON 序列化
+except ImportError:
+    orjson = None
+
+# orjson.loads 與 json.loads 都能直接解析 UTF-8 bytes
+json_loads = orjson.loads if orjson is not None else json.loads
+
+if orjson is not None:
+    def json_dumps_bytes(obj):
+        """將物件序列化為緊湊的 UTF-8 JSON bytes（中文不轉碼）。"""
+        return orjson.dumps(obj)
+
+    def json_dumps(obj):
+        """將物件序列化為緊湊的 JSON 字串（中文不轉碼）。"""
+        return orjson.dumps(obj).decode("utf-8")
+else:
+    # 未安裝 orjson 時退回標準函式庫，預先建立 encoder 省去每次 json.dumps 解析參數
+    json_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def json_dumps_bytes(obj):
+        """將物件序列化為緊湊的 UTF-8 JSON bytes（中文不轉碼）。"""
+        return json_dumps(obj).encode("utf-8")
+
+
+def iso_to_datetime(iso_str):
+    """
+    將 Threads API 的 ISO8601 時間字串（例如 "2024-07-01T00:00:00+0000"）解析為帶時區的 datetime。
+    先把 +0000 形式的時區補成 +00:00，再交給以 C 實作的 fromisoformat，比 strptime 快許多。
+    """
+    if len(iso_str) > 5 and iso_str[-5] in "+-" and iso_str[-3] != ":":
+        iso_str = f"{iso_str[:-2]}:{iso_str[-2:]}"
+    return datetime.datetime.fromisoformat(iso_str)
+
+
+_UNIX_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
 
 
 def iso_to_unix(iso_str):
-    dt = datetime.datetime.strptime(iso_str, "%Y-%m-%dT%H:%M:%S%z")
+    """
+    將 ISO8601 時間字串轉換為 Unix timestamp（秒）。
+    API 的固定格式（例如 "2024-07-01T00:00:00+0000"）直接依位置切出數字計算，不經過 strptime；
+    日期部分以 datetime.date 換算天數，不存在的日期（例如 2 月 30 日）與超出範圍的時分秒會拋出 ValueError。
+    其他格式則交給 iso_to_datetime 解析。
+    """
+    if _is_api_timestamp(iso_str):
+        return _api_day_seconds(iso_str) + _api_time_seconds(iso_str)
+    dt = iso_to_datetime(iso_str)
+    if dt.tzinfo is None:
+        raise ValueError(f"時間字串缺少時區資訊: {iso_str}")
     return int(dt.timestamp())
 
 
+def iso_to_unix_many(iso_strs):
+    """
+    批次將多個 ISO8601 時間字串轉換為 Unix timestamp（秒）的 list。
+    同一天的時間字串共用日期部分（該日 00:00 UTC 的秒數）的計算結果，只需再加上時分秒與時區偏移；
+    非 API 固定格式的字串則逐筆交給 iso_to_unix。
+    """
+    day_seconds_cache = {}
+    result = []
+    for iso_str in iso_strs:
+        if not _is_api_timestamp(iso_str):
+            result.append(iso_to_unix(iso_str))
+            continue
+        date_str = iso_str[:10]
+        day_seconds = day_seconds_cache.get(date_str)
+        if day_seconds is None:
+            day_seconds = day_seconds_cache[date_str] = _api_day_seconds(date_str)
+        result.append(day_seconds + _api_time_seconds(iso_str))
+    return result
+
+
+def _api_day_seconds(iso_str):
+    """API 固定格式的日期部分（前 10 個字元）換算為該日 00:00 UTC 的 Unix timestamp；日期不存在時拋出 ValueError。"""
+    date = datetime.date(int(iso_str[0:4]), int(iso_str[5:7]), int(iso_str[8:10]))
+    return (date.toordinal() - _UNIX_EPOCH_ORDINAL) * 86400
+
+
+def _api_time_seconds(iso_str):
+    """API 固定格式的時分秒換算為秒數並扣除時區偏移（結果可能為負或超過一天）；時分秒或時區偏移超出範圍時拋出 ValueError。"""
+    hour, minute, second = int(iso_str[11:13]), int(iso_str[14:16]), int(iso_str[17:19])
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError(f"時間超出範圍: {iso_str}")
+    seconds = hour * 3600 + minute * 60 + second
+    offset_hour, offset_minute = int(iso_str[20:22]), int(iso_str[22:24])
+    if offset_hour > 23 or offset_minute > 59:
+        raise ValueError(f"時區偏移超出範圍: {iso_str}")
+    offset = offset_hour * 3600 + offset_minute * 60
+    return seconds - offset if iso_str[19] == "+" else seconds + offset
+
+
+# 數字欄位只接受 ASCII 0-9，避免 int() 容許的正負號、空白或全形數字被當成合法欄位
+_API_TIMESTAMP_RE = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}[+-]\d{4}", re.ASCII)
+
+
+def _is_api_timestamp(iso_str):
+    """是否為 Threads API 的固定格式：YYYY-MM-DDTHH:MM:SS±HHMM（24 個字元），其他格式交給 iso_to_datetime 解析。"""
+    return len(iso_str) == 24 and _API_TIMESTAMP_RE.fullmatch(iso_str) is not None
+
+
+# 配置檔超過此大小且有安裝 orjson 時，以 mmap 映射檔案直接解析，不先複製成 bytes
+_MMAP_THRESHOLD = 64 * 1024
+_SECONDS_PER_DAY = 86400
+_EXPIRY_RECHECK_SECONDS = 60  # 距上次檢查未滿此秒數時，near_expiry 不重新 stat 配置檔
+
+
+class ConfigManager:
+    __slots__ = ("_path", "_mtime_ns", "_config", "_expires_at", "_checked_at")
+
+    def __init__(self, path="config.json"):
+        """
+        管理單一 JSON 配置檔：保存解析後的配置與檔案修改時間（mtime_ns），
+        讀取 access_token、檢查權杖是否即將過期與寫入新權杖都共用同一份解析結果，
+        檔案有變動時才重新讀檔與解析。建立時即讀取一次，檔案不存在則拋出 FileNotFoundError。
+        """
+        self._path = path
+        self._mtime_ns = None
+        self._config = None
+        self._expires_at = None
+        self._checked_at = 0.0
+        self._refresh_if_stale()
+
+    def _refresh_if_stale(self):
+        """重新 stat 配置檔，mtime 與快取不同時才重新讀檔與解析。"""
+        # EAFP：不事先檢查檔案是否存在，直接存取並攔截 FileNotFoundError，避免多一次路徑查找與檢查/開啟之間的競態
+        try:
+            if self._config is not None and os.stat(self._path).st_mtime_ns == self._mtime_ns:
+                return
+            with open(self._path, 'rb') as f:
+                # 以已開啟檔案的 fstat 取得 mtime，確保快取的 mtime 與實際讀到的內容一致
+                stat = os.fstat(f.fileno())
+                if orjson is not None and stat.st_size > _MMAP_THRESHOLD:
+                    config = _loads_mapped(f)
+                else:
+                    config = json_loads(f.read())
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Config file {self._path} not found.") from None
+        self._set_config(stat.st_mtime_ns, config)
+
+    def _set_config(self, mtime_ns, config):
+        """以新解析的配置與其 mtime 更新快取。"""
+        self._mtime_ns = mtime_ns
+        # 以唯讀檢視保存，呼叫端無法修改共用的配置內容，也不必每次複製
+        self._config = types.MappingProxyType(config)
+        # 只在重新讀檔時轉型一次，之後每次檢查直接使用整數
+        expires_at = config.get("expires_at")
+        self._expires_at = int(expires_at) if expires_at else None
+
+    @property
+    def config(self):
+        """目前的配置內容（唯讀的 types.MappingProxyType）；需要修改時請先以 dict() 複製。"""
+        self._refresh_if_stale()
+        return self._config
+
+    @property
+    def access_token(self):
+        """配置中的 access_token，無法取得時拋出 ValueError。"""
+        token = self.config.get("access_token")
+        if not token:
+            raise ValueError("access_token not found in config file.")
+        return token
+
+    def near_expiry(self, threshold_days=7):
+        """
+        權杖剩餘時間是否小於 threshold_days 天；沒有 expires_at 記錄時視為需要刷新，回傳 True。
+        距上次檢查未滿 60 秒時直接使用記憶體中的 expires_at，不重新 stat 配置檔。
+        """
+        now = time.time()
+        if now - self._checked_at >= _EXPIRY_RECHECK_SECONDS:
+            self._refresh_if_stale()
+            self._checked_at = now
+        if not self._expires_at:
+            return True
+        return self._expires_at - now < threshold_days * _SECONDS_PER_DAY
+
+    def update(self, new_token, expires_in):
+        """
+        寫入新的 access_token 與 expires_at（現在時間 + expires_in 秒的 Unix timestamp），
+        回傳更新後配置的唯讀 mapping。
+        """
+        config = dict(self.config)
+        config["access_token"] = new_token
+        config["expires_at"] = int(time.time()) + expires_in
+        # 配置檔只供程式讀取，寫成緊湊格式（不縮排）：序列化較快、檔案較小，之後讀取解析也較快
+        data = json_dumps_bytes(config)
+        # 先寫入暫存檔並 fsync，再以 os.replace 原子性地取代原檔，
+        # 寫入途中當機或被中斷時，原本的配置檔仍保持完整
+        tmp_path = self._path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # 寫入後以新的 mtime 更新快取，下次讀取不必再解析剛寫入的內容
+        self._set_config(os.stat(self._path).st_mtime_ns, config)
+        self._checked_at = time.time()
+        return self._config
+
+
+def _loads_mapped(f):
+    """以唯讀 mmap 映射已開啟的檔案，讓 orjson 直接從映射的記憶體分頁解析 JSON。"""
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # memoryview 必須在 mmap 關閉前釋放，否則關閉時會拋出 BufferError
+        with memoryview(mm) as view:
+            return orjson.loads(view)
+
+
+# 每個配置檔路徑共用一個 ConfigManager：config_path -> ConfigManager
+_CONFIG_MANAGERS = {}
+
+
+def get_config_manager(config_path="config.json"):
+    """取得指定配置檔的 ConfigManager，第一次使用時才建立（讀檔）。"""
+    manager = _CONFIG_MANAGERS.get(config_path)
+    if manager is None:
+        manager = _CONFIG_MANAGERS[config_path] = ConfigManager(config_path)
+    return manager
+
+
 def load_config(config_path="config.json"):
     """
     從指定的 JSON 配置檔案讀取配置。
     若檔案不存在，則會拋出 FileNotFoundError。
-    回傳值為一個 dict，包含配置檔中所有的鍵值資料。
+    回傳值為一個唯讀的 mapping（types.MappingProxyType），包含配置檔中所有的鍵值資料；需要修改時請先以 dict() 複製。
+    解析結果依檔案修改時間（mtime_ns）快取，檔案未變動時不會重新讀檔與解析。
     """
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"Config file {config_path} not found.")
-    with open(config_path, 'r', encoding='utf-8') as f:
-        config = json.load(f)
-    return config
+    return get_config_manager(config_path).config
 
 
 def get_access_token(config_path="config.json"):
@@ -28,11 +247,7 @@ def get_access_token(config_path="config.json"):
     此函數假設 config.json 中有 "access_token" 這個鍵值。
     如無法取得將會拋出 ValueError。
     """
-    config = load_config(config_path)
-    token = config.get("access_token")
-    if not token:
-        raise ValueError("access_token not found in config file.")
-    return token
+    return get_config_manager(config_path).access_token
 
 
 def update_config_token(new_token, new_expires_in, config_path="config.json"):
@@ -40,16 +255,9 @@ def update_config_token(new_token, new_expires_in, config_path="config.json"):
     根據刷新 API 返回的資料，更新 config.json 中的 access_token 與 expires_at。
     new_expires_in 是從 API 回傳的秒數（例如 5184000 秒約為60天）。
     expires_at 儲存為 Unix timestamp。
+    回傳更新後配置的唯讀 mapping。
     """
-    config = load_config(config_path)
-    current_ts = int(time.time())
-    # 計算新的過期時間
-    new_expires_at = current_ts + new_expires_in
-    config["access_token"] = new_token
-    config["expires_at"] = new_expires_at
-    with open(config_path, "w", encoding="utf-8") as f:
-        json.dump(config, f, ensure_ascii=False, indent=4)
-    return config
+    return get_config_manager(config_path).update(new_token, new_expires_in)
 
 
 def is_token_near_expiry(threshold_days=7, config_path="config.json"):
@@ -58,12 +266,6 @@ def is_token_near_expiry(threshold_days=7, config_path="config.json"):
       - 若 config 中含有 expires_at 欄位，則計算剩餘秒數。
       - 如果剩餘時間小於 threshold_days（預設7天）則回傳 True。
       - 否則回傳 False。
+    expires_at 會快取在記憶體中，每 60 秒才重新檢查一次 config.json 是否有變動。
     """
-    config = load_config(config_path)
-    expires_at = config.get("expires_at")
-    if not expires_at:
-        # 若沒有 expires_at 記錄，則視為需要刷新
-        return True
-    current_ts = int(time.time())
-    remaining = int(expires_at) - current_ts
-    return remaining < threshold_days * 24 * 3600
+    return get_config_manager(config_path).near_expiry(threshold_days)